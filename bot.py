@@ -1,7 +1,18 @@
 import os
+import re
+import time
+import asyncio
 import logging
+import aiohttp
+from concurrent.futures import ThreadPoolExecutor
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from config import Config
+
+try:
+    import google.generativeai as genai
+except ImportError:
+    genai = None
 
 # Setup logging
 logging.basicConfig(
@@ -9,60 +20,170 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+# Static replies
+_TEXT_START = (
+    "🤖 **Video Generator Bot**\n\n"
+    "🚀 **Now Working!**\n\n"
+    "Available Commands:\n"
+    "/test - Test API connections\n"
+    "/models - List available AI models\n\n"
+    "**How to use:**\n"
+    "1. Send a photo\n"
+    "2. Send a prompt for video\n"
+    "3. Get your generated video!"
+)
+
+_TEXT_PHOTO = (
+    "🖼️ **Photo received!**\n\n"
+    "Now send me a prompt for the video.\n"
+    "Example: 'slow motion' or 'cinematic movement'"
+)
+
+_TEXT_PHOTO_TOO_LARGE = (
+    f"❌ Photo is too large (max {Config.MAX_FILE_SIZE // (1024 * 1024)}MB).\n"
+    "Please send a smaller image."
+)
+
+_TEXT_PROMPT_EMPTY = "❌ Prompt is empty. Describe the motion you want, e.g. 'slow motion'."
+
+_TEXT_PROMPT_TOO_LONG = f"❌ Prompt is too long (max {Config.MAX_PROMPT_LENGTH} characters)."
+
+_TEXT_MODELS_HEADER = "🤖 **Available Google AI Models:**\n\n"
+
+_TEXT_TEST_RESULTS = """
+🧪 **API TEST RESULTS**
+
+Google AI:
+{google_status}
+
+Stability AI:
+{stability_status}
+
+**Recommendation:**
+{recommendation}
+"""
+
+_TEXT_READY = "✅ Ready for video generation"
+_TEXT_NEED_STABILITY = "❌ Add STABILITY_API_KEY for video generation"
+
+_GEMINI_RE = re.compile(r'gemini', re.IGNORECASE)
+
+# Error replies, keyed by handler
+_ERR = {
+    "test": "❌ Test failed: {e}",
+    "models": "❌ Error getting models: {e}",
+}
+
 class WorkingVideoBot:
     def __init__(self):
-        self.token = os.getenv('TELEGRAM_TOKEN')
+        self.token = Config.TELEGRAM_TOKEN
         if not self.token:
             print("❌ ERROR: TELEGRAM_TOKEN not set!")
             exit(1)
             
-        self.application = Application.builder().token(self.token).build()
+        self.application = (
+            Application.builder()
+            .token(self.token)
+            .concurrent_updates(True)
+            .post_init(self.on_startup)
+            .post_shutdown(self.on_shutdown)
+            .build()
+        )
+        self.http = None
+        self._genai_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="genai")
+        self._models_cache = None
+        self._models_cache_ts = 0
+        self._models_lock = asyncio.Lock()
+        self._genai_model = None
+        if genai is not None:
+            genai.configure(api_key=Config.GOOGLE_AI_API_KEY)
+        self.stability_headers = {
+            "Authorization": f"Bearer {Config.STABILITY_API_KEY}",
+        } if Config.STABILITY_API_KEY else {}
         self.setup_handlers()
         print("✅ Bot initialized successfully!")
     
+    async def on_startup(self, application: Application):
+        """Create the shared HTTP session once the event loop is running"""
+        self.http = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=32, keepalive_timeout=60)
+        )
+    
+    async def on_shutdown(self, application: Application):
+        """Close the shared HTTP session"""
+        if self.http:
+            await self.http.close()
+        self._genai_executor.shutdown(wait=False)
+    
     def setup_handlers(self):
-        self.application.add_handler(CommandHandler("start", self.start_command))
-        self.application.add_handler(CommandHandler("test", self.test_command))
-        self.application.add_handler(CommandHandler("models", self.models_command))
-        self.application.add_handler(MessageHandler(filters.PHOTO, self.handle_photo))
-        self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_text))
+        commands = (
+            ("start", self.start_command),
+            ("test", self.test_command),
+            ("models", self.models_command),
+        )
+        messages = (
+            (filters.PHOTO, self.handle_photo),
+            (filters.TEXT & ~filters.COMMAND, self.handle_text),
+        )
+        
+        # block=False lets a slow handler (e.g. /test) run without holding up other updates
+        self.application.add_handlers(
+            [CommandHandler(name, callback, block=False) for name, callback in commands]
+            + [MessageHandler(message_filter, callback, block=False) for message_filter, callback in messages]
+        )
+    
+    async def _reply_error(self, update: Update, key: str, **kw):
+        """Log the active exception and send the matching error reply"""
+        logging.exception(f"{key} failed for user {update.effective_user.id}")
+        await update.message.reply_text(_ERR[key].format(**kw))
     
     async def start_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        await update.message.reply_text(
-            "🤖 **Video Generator Bot**\n\n"
-            "🚀 **Now Working!**\n\n"
-            "Available Commands:\n"
-            "/test - Test API connections\n"
-            "/models - List available AI models\n\n"
-            "**How to use:**\n"
-            "1. Send a photo\n"
-            "2. Send a prompt for video\n"
-            "3. Get your generated video!"
-        )
+        await update.message.reply_text(_TEXT_START)
+    
+    async def _list_models_async(self):
+        """Fetch the model list without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        # list_models() pages lazily, so consume it inside the worker thread
+        return await loop.run_in_executor(self._genai_executor, lambda: list(genai.list_models()))
+    
+    async def _generate_content_async(self, model, prompt):
+        """Run a blocking generate_content call in the genai executor"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._genai_executor, model.generate_content, prompt)
+    
+    async def _get_models(self, ttl=300):
+        """Return cached Gemini models and their display text, refreshed every ttl seconds"""
+        async with self._models_lock:
+            if self._models_cache is None or time.monotonic() - self._models_cache_ts >= ttl:
+                models = [model for model in await self._list_models_async() if _GEMINI_RE.search(model.name)]
+                parts = [_TEXT_MODELS_HEADER]
+                
+                for model in models:
+                    parts.append(f"• {model.name}\n")
+                    parts.append(f"  Supported: {', '.join(model.supported_generation_methods)}\n\n")
+                
+                self._models_cache = (models, ''.join(parts))
+                self._models_cache_ts = time.monotonic()
+            
+            return self._models_cache
     
     async def test_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Test available APIs"""
         try:
             # Test Google AI with correct model
-            google_key = os.getenv('GOOGLE_AI_API_KEY')
-            if google_key:
-                import google.generativeai as genai
-                genai.configure(api_key=google_key)
-                
-                # Get available models
-                models = genai.list_models()
-                available_models = [model.name for model in models]
+            if genai is None:
+                google_status = "❌ genai not installed"
+            elif Config.GOOGLE_AI_API_KEY:
+                # Get available models (cached)
+                models, _ = await self._get_models()
                 
                 # Try to use a working model
-                working_model = None
-                for model_name in available_models:
-                    if 'gemini' in model_name.lower():
-                        working_model = model_name
-                        break
+                working_model = models[0].name if models else None
                 
                 if working_model:
-                    model = genai.GenerativeModel(working_model)
-                    response = model.generate_content("Hello, test response")
+                    if self._genai_model is None or self._genai_model.model_name != working_model:
+                        self._genai_model = genai.GenerativeModel(working_model)
+                    response = await self._generate_content_async(self._genai_model, "Hello, test response")
                     google_status = f"✅ Connected - Model: {working_model}"
                 else:
                     google_status = "❌ No Gemini models found"
@@ -70,69 +191,64 @@ class WorkingVideoBot:
                 google_status = "❌ No API Key"
             
             # Test Stability AI
-            stability_key = os.getenv('STABILITY_API_KEY')
-            if stability_key:
-                import requests
-                headers = {"Authorization": f"Bearer {stability_key}"}
-                response = requests.get(
+            if self.stability_headers:
+                async with self.http.get(
                     "https://api.stability.ai/v1/user/account",
-                    headers=headers,
-                    timeout=10
-                )
-                if response.status_code == 200:
+                    headers=self.stability_headers,
+                    timeout=aiohttp.ClientTimeout(total=10)
+                ) as response:
+                    status = response.status
+                
+                if status == 200:
                     stability_status = "✅ Connected"
                 else:
-                    stability_status = f"❌ API Error: {response.status_code}"
+                    stability_status = f"❌ API Error: {status}"
             else:
                 stability_status = "❌ No API Key"
             
-            test_results = f"""
-🧪 **API TEST RESULTS**
-
-Google AI:
-{google_status}
-
-Stability AI:
-{stability_status}
-
-**Recommendation:**
-{'✅ Ready for video generation' if stability_key else '❌ Add STABILITY_API_KEY for video generation'}
-            """
+            test_results = _TEXT_TEST_RESULTS.format(
+                google_status=google_status,
+                stability_status=stability_status,
+                recommendation=_TEXT_READY if self.stability_headers else _TEXT_NEED_STABILITY
+            )
             await update.message.reply_text(test_results)
             
         except Exception as e:
-            await update.message.reply_text(f"❌ Test failed: {str(e)}")
+            await self._reply_error(update, "test", e=e)
     
     async def models_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """List available Google AI models"""
+        if genai is None:
+            await update.message.reply_text(_ERR["models"].format(e="genai not installed"))
+            return
+        
         try:
-            import google.generativeai as genai
-            genai.configure(api_key=os.getenv('GOOGLE_AI_API_KEY'))
-            
-            models = genai.list_models()
-            model_list = "🤖 **Available Google AI Models:**\n\n"
-            
-            for model in models:
-                if 'gemini' in model.name.lower():
-                    model_list += f"• {model.name}\n"
-                    model_list += f"  Supported: {', '.join(method for method in model.supported_generation_methods)}\n\n"
-            
+            _, model_list = await self._get_models()
             await update.message.reply_text(model_list)
             
         except Exception as e:
-            await update.message.reply_text(f"❌ Error getting models: {str(e)}")
+            await self._reply_error(update, "models", e=e)
     
     async def handle_photo(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle photo upload"""
-        await update.message.reply_text(
-            "🖼️ **Photo received!**\n\n"
-            "Now send me a prompt for the video.\n"
-            "Example: 'slow motion' or 'cinematic movement'"
-        )
+        # Reject oversized uploads before any work is queued for them
+        photo = update.message.photo[-1]
+        if photo.file_size and photo.file_size > Config.MAX_FILE_SIZE:
+            await update.message.reply_text(_TEXT_PHOTO_TOO_LARGE)
+            return
+        
+        await update.message.reply_text(_TEXT_PHOTO)
     
     async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Handle text messages"""
-        text = update.message.text
+        text = update.message.text.strip()
+        if not text:
+            await update.message.reply_text(_TEXT_PROMPT_EMPTY)
+            return
+        if len(text) > Config.MAX_PROMPT_LENGTH:
+            await update.message.reply_text(_TEXT_PROMPT_TOO_LONG)
+            return
+        
         await update.message.reply_text(
             f"📝 **Prompt received:** {text}\n\n"
             "Currently setting up video generation...\n"
@@ -141,7 +257,20 @@ Stability AI:
     
     def run(self):
         print("🚀 Starting Working Video Bot...")
-        self.application.run_polling(drop_pending_updates=True)
+        
+        # Railway exposes a public domain; use webhooks there, polling locally
+        public_domain = os.getenv('RAILWAY_PUBLIC_DOMAIN')
+        if public_domain:
+            self.application.run_webhook(
+                listen="0.0.0.0",
+                port=int(os.getenv('PORT', '8443')),
+                url_path=self.token,
+                webhook_url=f"https://{public_domain}/{self.token}",
+                secret_token=os.getenv('TG_SECRET'),
+                drop_pending_updates=True
+            )
+        else:
+            self.application.run_polling(drop_pending_updates=True)
 
 if __name__ == "__main__":
     # Check environment
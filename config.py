@@ -1,4 +1,5 @@
 import os
+import tempfile
 from dotenv import load_dotenv
 
 if os.path.exists('.env'):
@@ -18,7 +19,29 @@ class Config:
     # Bot Settings
     MAX_FILE_SIZE = 10 * 1024 * 1024
     MAX_VIDEO_DURATION = 10
+    MAX_PROMPT_LENGTH = 500
     REQUEST_TIMEOUT = 180
+    GEN_CONCURRENCY = int(os.getenv('GEN_CONCURRENCY', '3'))
+    GEMINI_CONCURRENCY = int(os.getenv('GEMINI_CONCURRENCY', '10'))
+    STABILITY_CONCURRENCY = int(os.getenv('STABILITY_CONCURRENCY', '5'))
+    
+    # Scratch directory for generated files (e.g. /dev/shm); None uses the system default
+    TMP_DIR = os.getenv('TMP_DIR') or None
+    
+    # Generated video cache
+    VIDEO_CACHE_DIR = os.getenv('VIDEO_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'video_genai_cache'))
+    VIDEO_CACHE_TTL = 24 * 60 * 60
+    
+    # Stop calling Stability AI for a while after repeated failures
+    STABILITY_BREAKER_THRESHOLD = 3
+    STABILITY_BREAKER_COOLDOWN = 60
+    
+    # Stability result polling (exponential backoff)
+    POLL_BASE_DELAY = 1.0
+    POLL_BACKOFF_FACTOR = 1.5
+    POLL_MAX_DELAY = 10
+    # Total time to wait for a result, matching the old 30 x 5s schedule
+    POLL_TIMEOUT = 150
     
     # Supported Formats
     SUPPORTED_FORMATS = ['image/jpeg', 'image/png', 'image/jpg']
@@ -1,9 +1,18 @@
+import os
+import tempfile
+import mimetypes
 import aiohttp
+import orjson
+import aiofiles
 import asyncio
-import requests
+import random
+import time
 from config import Config
 import logging
 from utils.gemini_client import GeminiVideoClient
+from utils.cache import VideoCache, copy_to_temp
+from utils.circuit_breaker import stability_breaker, is_upstream_failure
+from utils.limits import stability_sem
 
 class VideoAPIClients:
     def __init__(self):
@@ -14,95 +23,226 @@ class VideoAPIClients:
         self.luma_headers = {
             "Authorization": f"Bearer {Config.LUMA_API_KEY}",
         } if Config.LUMA_API_KEY else {}
+        # Cap simultaneous generations to stay within upstream quotas
+        self._gen_sem = asyncio.Semaphore(Config.GEN_CONCURRENCY)
+        self._session = None
+        self.video_cache = VideoCache()
+        self._inflight = {}
     
-    async def generate_video_from_image_prompt(self, image_path: str, prompt: str) -> str:
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Return the shared HTTP session, creating it on first use"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=32, ttl_dns_cache=300, keepalive_timeout=75)
+            )
+        return self._session
+    
+    async def close(self):
+        """Close the shared HTTP sessions"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+        await self.gemini_client.close()
+    
+    async def generate_video_from_image_prompt(self, image_path: str, prompt: str, namespace: str = "") -> str:
         """Main video generation method using Gemini AI"""
         try:
-            # Try Gemini-enhanced generation first
-            logging.info("🎨 Using Gemini AI for enhanced video generation...")
-            video_path = await self.gemini_client.generate_video_from_image_prompt(image_path, prompt)
+            async with aiofiles.open(image_path, 'rb') as img_file:
+                image_bytes = await img_file.read()
+        except Exception as e:
+            logging.error(f"Image read error: {e}")
+            return None
+        
+        # Identical image + prompt pairs reuse the earlier result
+        cache_key = VideoCache.make_key(image_bytes, prompt, namespace)
+        cached_path = await asyncio.to_thread(self.video_cache.get, cache_key)
+        if cached_path:
+            logging.info("♻️ Returning cached video")
+            return cached_path
+        
+        # An identical job is already running: wait for it instead of paying twice
+        pending = self._inflight.get(cache_key)
+        if pending:
+            return await self._shared_result(cache_key, await asyncio.shield(pending))
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        video_path = None
+        try:
+            async with self._gen_sem:
+                video_path = await self._generate_video(image_path, prompt, image_bytes)
             
             if video_path:
-                return video_path
+                await asyncio.to_thread(self.video_cache.put, cache_key, video_path)
+        finally:
+            del self._inflight[cache_key]
+            future.set_result(video_path)
+        
+        return video_path
+    
+    async def _shared_result(self, cache_key: str, video_path: str) -> str:
+        """Give a waiting caller its own copy of another caller's result"""
+        if not video_path:
+            return None
+        
+        cached_path = await asyncio.to_thread(self.video_cache.get, cache_key)
+        if cached_path:
+            return cached_path
+        
+        try:
+            return await asyncio.to_thread(copy_to_temp, video_path)
+        except Exception as e:
+            logging.error(f"Shared result copy error: {e}")
+            return None
+    
+    async def _generate_video(self, image_path: str, prompt: str, image_bytes: bytes = None) -> str:
+        """Gemini-enhanced generation with direct Stability AI fallback"""
+        if not stability_breaker.allow():
+            logging.warning("⚡ Stability AI circuit open, skipping video generation")
+            return None
+        
+        try:
+            # Try Gemini-enhanced generation first
+            logging.info("🎨 Using Gemini AI for enhanced video generation...")
+            video_path, upstream_failed = await self.gemini_client.generate_video_with_status(
+                image_path, prompt, image_bytes
+            )
             
             # Fallback to direct Stability AI if Gemini fails
-            logging.info("🔄 Falling back to direct Stability AI...")
-            return await self.stability_image_to_video(image_path, prompt)
+            if not video_path and self.stability_headers and stability_breaker.allow():
+                logging.info("🔄 Falling back to direct Stability AI...")
+                video_path, fallback_upstream_failed = await self._stability_request(image_path, prompt, image_bytes)
+                upstream_failed = upstream_failed or fallback_upstream_failed
+            
+            # One breaker outcome per generation, however many attempts it took
+            stability_breaker.record_outcome(bool(video_path), upstream_failed)
+            return video_path
             
         except Exception as e:
             logging.error(f"Video generation error: {e}")
             return None
     
-    async def stability_image_to_video(self, image_path: str, prompt: str = ""):
+    async def stability_image_to_video(self, image_path: str, prompt: str = "", image_bytes: bytes = None):
         """Direct Stability AI video generation"""
         if not self.stability_headers:
             return None
-            
+        
+        if not stability_breaker.allow():
+            logging.warning("⚡ Stability AI circuit open, skipping direct generation")
+            return None
+        
+        video_path, upstream_failed = await self._stability_request(image_path, prompt, image_bytes)
+        stability_breaker.record_outcome(bool(video_path), upstream_failed)
+        
+        return video_path
+    
+    async def _stability_request(self, image_path: str, prompt: str, image_bytes: bytes = None) -> tuple:
+        """Submit an image-to-video job and wait for it; returns (video_path, upstream_failed)"""
         try:
-            async with aiohttp.ClientSession() as session:
-                with open(image_path, 'rb') as img_file:
-                    form_data = aiohttp.FormData()
-                    form_data.add_field('image', img_file)
-                    form_data.add_field('seed', '0')
-                    form_data.add_field('cfg_scale', '1.8')
-                    form_data.add_field('motion_bucket_id', '127')
-                    
-                    if prompt:
-                        form_data.add_field('prompt', prompt)
-                
+            session = await self._get_session()
+            # Reuse bytes the caller already read for the cache key
+            if image_bytes is None:
+                async with aiofiles.open(image_path, 'rb') as img_file:
+                    image_bytes = await img_file.read()
+            
+            form_data = aiohttp.FormData()
+            form_data.add_field(
+                'image',
+                image_bytes,
+                filename=os.path.basename(image_path),
+                content_type=mimetypes.guess_type(image_path)[0] or 'image/jpeg'
+            )
+            form_data.add_field('seed', '0')
+            form_data.add_field('cfg_scale', '1.8')
+            form_data.add_field('motion_bucket_id', '127')
+            
+            if prompt:
+                form_data.add_field('prompt', prompt)
+            
+            async with stability_sem:
                 async with session.post(
                     "https://api.stability.ai/v2beta/image-to-video",
                     headers=self.stability_headers,
                     data=form_data,
                     timeout=aiohttp.ClientTimeout(total=Config.REQUEST_TIMEOUT)
                 ) as response:
-                    
+                
                     if response.status == 200:
-                        data = await response.json()
+                        data = await response.json(loads=orjson.loads)
                         generation_id = data.get('id')
-                        return await self._poll_stability_result(session, generation_id)
                     else:
                         error_text = await response.text()
                         logging.error(f"Stability API error: {error_text}")
-                        return None
+                        return None, is_upstream_failure(response.status)
+            
+            return await self._poll_stability_result(session, generation_id)
                         
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            # Timeouts and connection errors mean Stability is unreachable
+            logging.error(f"Stability client error: {e}")
+            return None, True
         except Exception as e:
             logging.error(f"Stability client error: {e}")
-            return None
+            return None, False
     
-    async def _poll_stability_result(self, session, generation_id: str, max_attempts: int = 30):
-        """Poll for Stability AI result"""
+    async def _poll_stability_result(self, session, generation_id: str, max_attempts: int = 30) -> tuple:
+        """Poll for Stability AI result; returns (video_path, upstream_failed)"""
+        # Ask for the raw mp4 so a finished job is returned in the same response
+        headers = {**self.stability_headers, "Accept": "video/*"}
+        
+        backoff_step = 0
+        deadline = time.monotonic() + Config.POLL_TIMEOUT
         for attempt in range(max_attempts):
-            await asyncio.sleep(5)
+            delay = min(Config.POLL_MAX_DELAY, Config.POLL_BASE_DELAY * Config.POLL_BACKOFF_FACTOR ** backoff_step)
+            delay += random.random()
+            # Stop once the next poll would land past the overall budget
+            if time.monotonic() + delay > deadline:
+                break
+            await asyncio.sleep(delay)
             
             try:
-                async with session.get(
-                    f"https://api.stability.ai/v2beta/image-to-video/result/{generation_id}",
-                    headers=self.stability_headers
-                ) as response:
+                async with stability_sem:
+                    async with session.get(
+                        f"https://api.stability.ai/v2beta/image-to-video/result/{generation_id}",
+                        headers=headers,
+                        timeout=aiohttp.ClientTimeout(total=Config.REQUEST_TIMEOUT)
+                    ) as response:
                     
-                    if response.status == 200:
-                        video_data = await response.read()
-                        return self._save_video_file(video_data, f"stability_{generation_id}")
+                        if response.status == 200:
+                            return await self._stream_video_file(response), False
                     
-                    elif response.status == 202:
-                        continue
-                    else:
-                        break
+                        elif response.status == 202:
+                            backoff_step += 1
+                            continue
+                        elif is_upstream_failure(response.status):
+                            # Server-side hiccup or throttling: keep polling, the job may still finish
+                            logging.warning(f"Stability result poll returned {response.status}, retrying")
+                            backoff_step += 1
+                            continue
+                        else:
+                            # Other 4xx is terminal (bad id, auth, moderation); stop polling
+                            logging.error(f"Stability result poll returned {response.status}")
+                            return None, False
                         
             except Exception as e:
                 logging.error(f"Polling error: {e}")
+                # Transient failure: retry from the base delay
+                backoff_step = 0
                 continue
         
-        return None
+        # Out of attempts: the job never finished or Stability kept failing
+        return None, True
     
-    def _save_video_file(self, video_data: bytes, filename: str) -> str:
-        """Save video data to temporary file"""
-        import tempfile
-        import os
+    async def _stream_video_file(self, response) -> str:
+        """Write a streamed video response to a temporary file chunk by chunk"""
+        fd, path = tempfile.mkstemp(suffix='.mp4', dir=Config.TMP_DIR)
         
-        temp_file = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-        temp_file.write(video_data)
-        temp_file.close()
+        try:
+            # Write through the fd mkstemp already opened; closed on exit
+            async with aiofiles.open(fd, 'wb') as video_file:
+                async for chunk in response.content.iter_chunked(1 << 16):
+                    await video_file.write(chunk)
+        except Exception:
+            os.unlink(path)
+            raise
         
-        return temp_file.name
\ No newline at end of file
+        return path
@@ -0,0 +1,103 @@
+import os
+import re
+import time
+import shutil
+import sqlite3
+import hashlib
+import logging
+import tempfile
+from contextlib import closing
+from config import Config
+
+_SEPARATOR_RE = re.compile(r'[\s_-]+')
+
+def normalize_prompt(prompt: str) -> str:
+    """Fold case, spacing and hyphens so 'Slow-motion' matches 'slow motion'; symbols and emoji are kept"""
+    return _SEPARATOR_RE.sub(' ', prompt.casefold()).strip()
+
+def copy_to_temp(video_path: str) -> str:
+    """Copy a video to a new temporary file and return its path"""
+    fd, path = tempfile.mkstemp(suffix='.mp4', dir=Config.TMP_DIR)
+    os.close(fd)
+    shutil.copyfile(video_path, path)
+    return path
+
+class VideoCache:
+    """Cache of generated videos, keyed by image hash + normalized prompt hash"""
+
+    def __init__(self, cache_dir: str = Config.VIDEO_CACHE_DIR, ttl: int = Config.VIDEO_CACHE_TTL):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.db_path = os.path.join(cache_dir, 'cache.db')
+
+        os.makedirs(cache_dir, exist_ok=True)
+        with closing(self._connect()) as db, db:
+            db.execute("CREATE TABLE IF NOT EXISTS cache(k TEXT PRIMARY KEY, path TEXT, ts INT)")
+
+    def _connect(self):
+        # One connection per call keeps the cache safe to use from worker threads
+        return sqlite3.connect(self.db_path)
+
+    @staticmethod
+    def make_key(image_bytes: bytes, prompt: str, namespace: str = "") -> str:
+        """Build the cache key for an image + prompt pair"""
+        image_hash = hashlib.sha256(image_bytes).hexdigest()
+        prompt_hash = hashlib.sha256(normalize_prompt(prompt).encode()).hexdigest()
+        return f"{namespace}:{image_hash}:{prompt_hash}"
+
+    def get(self, key: str) -> str:
+        """Return a private copy of the cached video, or None on miss"""
+        try:
+            with closing(self._connect()) as db:
+                row = db.execute("SELECT path, ts FROM cache WHERE k = ?", (key,)).fetchone()
+
+            if not row:
+                return None
+
+            cached_path, ts = row
+            if time.time() - ts > self.ttl or not os.path.exists(cached_path):
+                self._evict([(key, cached_path)])
+                return None
+
+            # Callers delete the returned file, so never hand out the cached one
+            return copy_to_temp(cached_path)
+
+        except Exception as e:
+            logging.error(f"Video cache read error: {e}")
+            return None
+
+    def put(self, key: str, video_path: str):
+        """Store a copy of a generated video under key"""
+        try:
+            cached_path = os.path.join(
+                self.cache_dir, hashlib.sha256(key.encode()).hexdigest() + '.mp4'
+            )
+            shutil.copyfile(video_path, cached_path)
+
+            with closing(self._connect()) as db, db:
+                db.execute(
+                    "INSERT OR REPLACE INTO cache(k, path, ts) VALUES (?, ?, ?)",
+                    (key, cached_path, int(time.time()))
+                )
+                expired = db.execute(
+                    "SELECT k, path FROM cache WHERE ts < ?", (int(time.time()) - self.ttl,)
+                ).fetchall()
+
+            self._evict(expired)
+
+        except Exception as e:
+            logging.error(f"Video cache write error: {e}")
+
+    def _evict(self, entries):
+        """Remove cache rows and their video files"""
+        if not entries:
+            return
+
+        with closing(self._connect()) as db, db:
+            db.executemany("DELETE FROM cache WHERE k = ?", [(key,) for key, _ in entries])
+
+        for _, cached_path in entries:
+            try:
+                os.unlink(cached_path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,45 @@
+import time
+import logging
+from config import Config
+
+class CircuitBreaker:
+    """Skip calls to an upstream for a cooldown period after repeated failures"""
+    
+    def __init__(self, name: str, threshold: int, cooldown: float):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.open_until = 0
+    
+    def allow(self) -> bool:
+        """Return True if a call may be attempted now"""
+        return time.monotonic() >= self.open_until
+    
+    def record_success(self):
+        self.failures = 0
+        self.open_until = 0
+    
+    def record_outcome(self, succeeded: bool, upstream_failed: bool):
+        """Record a call's result; failures caused by the request itself are ignored"""
+        if succeeded:
+            self.record_success()
+        elif upstream_failed:
+            self.record_failure()
+    
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.open_until = time.monotonic() + self.cooldown
+            logging.warning(f"⚡ {self.name} circuit open for {self.cooldown}s after {self.failures} failures")
+
+def is_upstream_failure(status: int) -> bool:
+    """True for statuses that mean the upstream is unavailable or throttling, not that the request was bad"""
+    return status == 429 or status >= 500
+
+# Shared by every client that talks to Stability AI
+stability_breaker = CircuitBreaker(
+    "Stability AI",
+    threshold=Config.STABILITY_BREAKER_THRESHOLD,
+    cooldown=Config.STABILITY_BREAKER_COOLDOWN
+)
@@ -1,83 +1,193 @@
 import google.generativeai as genai
+import os
 import logging
 import base64
 import tempfile
+import re
+import mimetypes
 import asyncio
-import aiohttp
+import random
+import time
+import hashlib
+from types import MappingProxyType
+from contextlib import nullcontext
+import httpx
+import aiofiles
+import orjson
 from config import Config
-from PIL import Image
-import io
+from utils.circuit_breaker import stability_breaker, is_upstream_failure
+from utils.limits import gemini_sem, stability_sem
+from utils.cache import normalize_prompt
+from cachetools import TTLCache
+
+# Gemini vision results keyed by image (+ prompt) content hash
+_vision_cache = TTLCache(maxsize=1024, ttl=3600)
+# Vision enhancements in flight, keyed like _vision_cache
+_vision_inflight = {}
+
+# Analysis keywords -> suggested motion, matched in one pass over the text
+_SUGGESTION_RULES = (
+    (("sky", "cloud"), "slow moving clouds"),
+    (("water", "river"), "flowing water motion"),
+    (("tree", "leaf"), "gentle leaf movement"),
+    (("person", "people"), "subtle human movement"),
+)
+_KEYWORD_SUGGESTIONS = MappingProxyType({
+    keyword: suggestion for keywords, suggestion in _SUGGESTION_RULES for keyword in keywords
+})
+# Case-insensitive so the analysis text never needs lowercasing as a whole;
+# ASCII-only folding keeps lookalikes such as 'ſky' from matching a keyword
+_KEYWORD_RE = re.compile('|'.join(map(re.escape, _KEYWORD_SUGGESTIONS)), re.IGNORECASE | re.ASCII)
+
+# Shared across GeminiVideoClient instances, built on first use
+_model = None
+
+def _get_model():
+    """Configure Gemini and build the shared model once per process"""
+    global _model
+    if _model is None:
+        genai.configure(api_key=Config.GOOGLE_AI_API_KEY)
+        _model = genai.GenerativeModel('gemini-1.5-flash')
+        logging.info("✅ Gemini AI Models Initialized")
+    return _model
 
 class GeminiVideoClient:
     def __init__(self):
-        # Configure Gemini
-        genai.configure(api_key=Config.GOOGLE_AI_API_KEY)
+        self.stability_headers = {
+            "Authorization": f"Bearer {Config.STABILITY_API_KEY}",
+        } if Config.STABILITY_API_KEY else {}
         
         # Initialize models
         try:
-            self.model = genai.GenerativeModel('gemini-1.5-flash')
-            self.vision_model = genai.GenerativeModel('gemini-1.5-flash')
-            logging.info("✅ Gemini AI Models Initialized")
+            # gemini-1.5-flash handles both text and vision; vision_model is kept as an alias
+            self.model = self.vision_model = _get_model()
         except Exception as e:
             logging.error(f"❌ Gemini initialization failed: {e}")
             raise
+        
+        # HTTP/2 multiplexes the submit and every result poll over one connection
+        self.http = httpx.AsyncClient(
+            http2=True,
+            timeout=Config.REQUEST_TIMEOUT,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+        )
+    
+    async def close(self):
+        """Close the shared HTTP client"""
+        await self.http.aclose()
     
-    async def generate_video_from_image_prompt(self, image_path: str, prompt: str) -> str:
+    async def generate_video_from_image_prompt(self, image_path: str, prompt: str, image_bytes: bytes = None) -> str:
         """
         Generate video using Gemini AI from image + prompt
         Note: Currently Gemini doesn't directly generate videos,
         but we can use it for enhanced image analysis and prompt generation
         for other video APIs
         """
+        # Don't pay for prompt enhancement when Stability would be skipped anyway
+        if not stability_breaker.allow():
+            logging.warning("⚡ Stability AI circuit open, skipping Gemini-enhanced generation")
+            return None
+        
+        video_path, upstream_failed = await self.generate_video_with_status(image_path, prompt, image_bytes)
+        stability_breaker.record_outcome(bool(video_path), upstream_failed)
+        
+        return video_path
+    
+    async def generate_video_with_status(self, image_path: str, prompt: str, image_bytes: bytes = None) -> tuple:
+        """
+        Gemini-enhanced generation without touching the circuit breaker.
+        Returns (video_path, upstream_failed); upstream_failed is True only when
+        Stability itself was unavailable, so callers can record one breaker outcome.
+        """
+        if not self.stability_headers:
+            logging.error("No Stability API key available")
+            return None, False
+        
         try:
+            # Read the image once for both steps, unless the caller already has it
+            if image_bytes is None:
+                async with aiofiles.open(image_path, 'rb') as img_file:
+                    image_bytes = await img_file.read()
+            
             # Step 1: Analyze image with Gemini for better prompt enhancement
-            enhanced_prompt = await self.enhance_prompt_with_vision(image_path, prompt)
+            enhanced_prompt = await self.enhance_prompt_with_vision(image_path, prompt, image_bytes)
             
             # Step 2: Generate video using enhanced prompt with other APIs
             # For now, we'll use Gemini to create better prompts for Stability AI
-            video_path = await self.fallback_to_stability_ai(image_path, enhanced_prompt)
-            
-            return video_path
+            return await self._stability_request(image_path, enhanced_prompt, image_bytes)
             
         except Exception as e:
             logging.error(f"Gemini video generation error: {e}")
-            return None
+            return None, False
     
-    async def enhance_prompt_with_vision(self, image_path: str, user_prompt: str) -> str:
+    async def enhance_prompt_with_vision(self, image_path: str, user_prompt: str, image_data: bytes = None) -> str:
         """Use Gemini Vision to analyze image and enhance the prompt"""
         try:
             # Load and prepare image
-            with open(image_path, 'rb') as img_file:
-                image_data = img_file.read()
-            
-            image = Image.open(io.BytesIO(image_data))
+            if image_data is None:
+                async with aiofiles.open(image_path, 'rb') as img_file:
+                    image_data = await img_file.read()
             
-            # Create prompt for analysis
-            analysis_prompt = f"""
-            Analyze this image and enhance the video generation prompt: "{user_prompt}"
+            cache_key = (
+                hashlib.sha256(image_data).hexdigest()
+                + hashlib.sha256(normalize_prompt(user_prompt).encode()).hexdigest()
+            )
+            if cache_key in _vision_cache:
+                return _vision_cache[cache_key]
             
-            Provide an improved, detailed prompt for video generation that includes:
-            1. Specific motion suggestions based on image content
-            2. Style recommendations
-            3. Camera movement ideas
-            4. Lighting and atmosphere
-            5. Object-specific animations
+            # The same image + prompt is already being enhanced: share that call
+            pending = _vision_inflight.get(cache_key)
+            if pending:
+                return await asyncio.shield(pending)
             
-            Return ONLY the enhanced prompt, nothing else.
-            """
-            
-            # Use Gemini Vision
-            response = self.vision_model.generate_content([analysis_prompt, image])
-            
-            enhanced_prompt = response.text.strip()
-            logging.info(f"🎨 Enhanced prompt: {enhanced_prompt}")
+            future = asyncio.get_running_loop().create_future()
+            _vision_inflight[cache_key] = future
+            enhanced_prompt = user_prompt
+            try:
+                enhanced_prompt = await self._call_gemini_vision(image_path, image_data, user_prompt)
+                if enhanced_prompt != user_prompt:
+                    _vision_cache[cache_key] = enhanced_prompt
+            finally:
+                del _vision_inflight[cache_key]
+                future.set_result(enhanced_prompt)
             
-            return enhanced_prompt if enhanced_prompt else user_prompt
+            return enhanced_prompt
             
         except Exception as e:
             logging.error(f"Gemini vision enhancement error: {e}")
             return user_prompt  # Return original prompt if enhancement fails
     
+    async def _call_gemini_vision(self, image_path: str, image_data: bytes, user_prompt: str) -> str:
+        """Ask Gemini Vision for an enhanced prompt"""
+        # Gemini accepts the encoded bytes inline, no need to decode pixels here
+        image = {
+            "mime_type": mimetypes.guess_type(image_path)[0] or "image/jpeg",
+            "data": image_data,
+        }
+        
+        # Create prompt for analysis
+        analysis_prompt = f"""
+        Analyze this image and enhance the video generation prompt: "{user_prompt}"
+        
+        Provide an improved, detailed prompt for video generation that includes:
+        1. Specific motion suggestions based on image content
+        2. Style recommendations
+        3. Camera movement ideas
+        4. Lighting and atmosphere
+        5. Object-specific animations
+        
+        Return ONLY the enhanced prompt, nothing else.
+        """
+        
+        # Use Gemini Vision
+        async with gemini_sem:
+            response = await self.vision_model.generate_content_async([analysis_prompt, image])
+        
+        enhanced_prompt = response.text.strip()
+        logging.info(f"🎨 Enhanced prompt: {enhanced_prompt}")
+        
+        return enhanced_prompt or user_prompt
+    
     async def generate_video_direct(self, prompt: str) -> str:
         """
         Direct text-to-video generation (when available)
@@ -97,12 +207,13 @@ class GeminiVideoClient:
             Format as a structured video plan.
             """
             
-            response = self.model.generate_content(video_script_prompt)
+            async with gemini_sem:
+                response = await self.model.generate_content_async(video_script_prompt)
             video_plan = response.text
             
             # Save plan as text (for now)
             # When Gemini Video API is available, we'll generate actual video
-            with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False) as f:
+            with tempfile.NamedTemporaryFile(mode='w', suffix='.txt', delete=False, dir=Config.TMP_DIR) as f:
                 f.write(f"Video Plan for: {prompt}\n\n{video_plan}")
                 return f.name
                 
@@ -110,94 +221,141 @@ class GeminiVideoClient:
             logging.error(f"Gemini direct video error: {e}")
             return None
     
-    async def fallback_to_stability_ai(self, image_path: str, enhanced_prompt: str) -> str:
+    async def fallback_to_stability_ai(self, image_path: str, enhanced_prompt: str, image_bytes: bytes = None) -> str:
         """Fallback to Stability AI with Gemini-enhanced prompt"""
+        if not self.stability_headers:
+            logging.error("No Stability API key available")
+            return None
+        
+        if not stability_breaker.allow():
+            logging.warning("⚡ Stability AI circuit open, skipping Gemini-enhanced generation")
+            return None
+        
+        video_path, upstream_failed = await self._stability_request(image_path, enhanced_prompt, image_bytes)
+        stability_breaker.record_outcome(bool(video_path), upstream_failed)
+        
+        return video_path
+    
+    async def _stability_request(self, image_path: str, enhanced_prompt: str, image_bytes: bytes = None) -> tuple:
+        """Submit an image-to-video job and wait for it; returns (video_path, upstream_failed)"""
         try:
-            if not Config.STABILITY_API_KEY:
-                logging.error("No Stability API key available")
-                return None
+            # Send bytes the caller already holds; otherwise stream from the file
+            image_source = open(image_path, 'rb') if image_bytes is None else nullcontext(image_bytes)
             
-            headers = {
-                "Authorization": f"Bearer {Config.STABILITY_API_KEY}",
-            }
+            async with stability_sem:
+                with image_source as image:
+                    response = await self.http.post(
+                        "https://api.stability.ai/v2beta/image-to-video",
+                        headers=self.stability_headers,
+                        files={
+                            'image': (
+                                os.path.basename(image_path),
+                                image,
+                                mimetypes.guess_type(image_path)[0] or 'image/jpeg'
+                            )
+                        },
+                        data={
+                            'seed': '0',
+                            'cfg_scale': '1.8',
+                            'motion_bucket_id': '127',
+                            'prompt': enhanced_prompt,
+                        }
+                    )
             
-            async with aiohttp.ClientSession() as session:
-                with open(image_path, 'rb') as img_file:
-                    form_data = aiohttp.FormData()
-                    form_data.add_field('image', img_file)
-                    form_data.add_field('seed', '0')
-                    form_data.add_field('cfg_scale', '1.8')
-                    form_data.add_field('motion_bucket_id', '127')
-                    form_data.add_field('prompt', enhanced_prompt)
-                
-                async with session.post(
-                    "https://api.stability.ai/v2beta/image-to-video",
-                    headers=headers,
-                    data=form_data,
-                    timeout=aiohttp.ClientTimeout(total=Config.REQUEST_TIMEOUT)
-                ) as response:
+            if response.status_code == 200:
+                generation_id = orjson.loads(response.content).get('id')
+                return await self._poll_stability_result(generation_id)
+            else:
+                logging.error(f"Stability API error: {response.text}")
+                return None, is_upstream_failure(response.status_code)
                     
-                    if response.status == 200:
-                        data = await response.json()
-                        generation_id = data.get('id')
-                        return await self._poll_stability_result(session, generation_id)
-                    else:
-                        error_text = await response.text()
-                        logging.error(f"Stability API error: {error_text}")
-                        return None
-                        
+        except httpx.TransportError as e:
+            # Timeouts and connection errors mean Stability is unreachable
+            logging.error(f"Stability fallback error: {e}")
+            return None, True
         except Exception as e:
             logging.error(f"Stability fallback error: {e}")
-            return None
+            return None, False
     
-    async def _poll_stability_result(self, session, generation_id: str, max_attempts: int = 30):
-        """Poll for Stability AI result"""
-        headers = {
-            "Authorization": f"Bearer {Config.STABILITY_API_KEY}",
-        }
+    async def _poll_stability_result(self, generation_id: str, max_attempts: int = 30) -> tuple:
+        """Poll for Stability AI result; returns (video_path, upstream_failed)"""
+        # Ask for the raw mp4 so a finished job is returned in the same response
+        headers = {**self.stability_headers, "Accept": "video/*"}
         
+        backoff_step = 0
+        deadline = time.monotonic() + Config.POLL_TIMEOUT
         for attempt in range(max_attempts):
-            await asyncio.sleep(5)
+            delay = min(Config.POLL_MAX_DELAY, Config.POLL_BASE_DELAY * Config.POLL_BACKOFF_FACTOR ** backoff_step)
+            delay += random.random()
+            # Stop once the next poll would land past the overall budget
+            if time.monotonic() + delay > deadline:
+                break
+            await asyncio.sleep(delay)
             
             try:
-                async with session.get(
-                    f"https://api.stability.ai/v2beta/image-to-video/result/{generation_id}",
-                    headers=headers
-                ) as response:
+                async with stability_sem:
+                    async with self.http.stream(
+                        "GET",
+                        f"https://api.stability.ai/v2beta/image-to-video/result/{generation_id}",
+                        headers=headers
+                    ) as response:
                     
-                    if response.status == 200:
-                        video_data = await response.read()
-                        return self._save_video_file(video_data, f"gemini_enhanced_{generation_id}")
+                        if response.status_code == 200:
+                            return await self._stream_video_file(response), False
                     
-                    elif response.status == 202:
-                        continue
-                    else:
-                        break
+                        elif response.status_code == 202:
+                            backoff_step += 1
+                            continue
+                        elif is_upstream_failure(response.status_code):
+                            # Server-side hiccup or throttling: keep polling, the job may still finish
+                            logging.warning(f"Stability result poll returned {response.status_code}, retrying")
+                            backoff_step += 1
+                            continue
+                        else:
+                            # Other 4xx is terminal (bad id, auth, moderation); stop polling
+                            logging.error(f"Stability result poll returned {response.status_code}")
+                            return None, False
                         
             except Exception as e:
                 logging.error(f"Polling error: {e}")
+                # Transient failure: retry from the base delay
+                backoff_step = 0
                 continue
         
-        return None
+        # Out of attempts: the job never finished or Stability kept failing
+        return None, True
     
-    def _save_video_file(self, video_data: bytes, filename: str) -> str:
-        """Save video data to temporary file"""
-        import tempfile
-        import os
+    async def _stream_video_file(self, response) -> str:
+        """Write a streamed video response to a temporary file chunk by chunk"""
+        fd, path = tempfile.mkstemp(suffix='.mp4', dir=Config.TMP_DIR)
         
-        temp_file = tempfile.NamedTemporaryFile(suffix='.mp4', delete=False)
-        temp_file.write(video_data)
-        temp_file.close()
+        try:
+            # Write through the fd mkstemp already opened; closed on exit
+            async with aiofiles.open(fd, 'wb') as video_file:
+                async for chunk in response.aiter_bytes(1 << 16):
+                    await video_file.write(chunk)
+        except Exception:
+            os.unlink(path)
+            raise
         
-        return temp_file.name
+        return path
     
     async def analyze_image_content(self, image_path: str) -> dict:
         """Use Gemini to analyze image content for better video generation"""
         try:
-            with open(image_path, 'rb') as img_file:
-                image_data = img_file.read()
+            async with aiofiles.open(image_path, 'rb') as img_file:
+                image_data = await img_file.read()
+            
+            cache_key = "analysis:" + hashlib.sha256(image_data).hexdigest()
+            if cache_key in _vision_cache:
+                analysis, suggestions = _vision_cache[cache_key]
+                return {'analysis': analysis, 'suggested_prompts': list(suggestions)}
             
-            image = Image.open(io.BytesIO(image_data))
+            # Gemini accepts the encoded bytes inline, no need to decode pixels here
+            image = {
+                "mime_type": mimetypes.guess_type(image_path)[0] or "image/jpeg",
+                "data": image_data,
+            }
             
             analysis_prompt = """
             Analyze this image in detail and provide:
@@ -210,28 +368,31 @@ class GeminiVideoClient:
             Return as a structured analysis.
             """
             
-            response = self.vision_model.generate_content([analysis_prompt, image])
-            return {
+            async with gemini_sem:
+                response = await self.vision_model.generate_content_async([analysis_prompt, image])
+            result = {
                 'analysis': response.text,
                 'suggested_prompts': self._extract_video_suggestions(response.text)
             }
             
+            # Cache an immutable copy; every caller gets its own dict and list
+            _vision_cache[cache_key] = (result['analysis'], tuple(result['suggested_prompts']))
+            return result
+            
         except Exception as e:
             logging.error(f"Image analysis error: {e}")
             return {}
     
+    async def analyze_images_batch(self, image_paths: list) -> list:
+        """Analyze several images concurrently, bounded by the Gemini semaphore"""
+        return await asyncio.gather(
+            *(self.analyze_image_content(image_path) for image_path in image_paths),
+            return_exceptions=True
+        )
+    
     def _extract_video_suggestions(self, analysis: str) -> list:
         """Extract video suggestions from Gemini analysis"""
-        # Simple extraction - you can make this more sophisticated
-        suggestions = []
-        
-        if "sky" in analysis.lower() or "cloud" in analysis.lower():
-            suggestions.append("slow moving clouds")
-        if "water" in analysis.lower() or "river" in analysis.lower():
-            suggestions.append("flowing water motion")
-        if "tree" in analysis.lower() or "leaf" in analysis.lower():
-            suggestions.append("gentle leaf movement")
-        if "person" in analysis.lower() or "people" in analysis.lower():
-            suggestions.append("subtle human movement")
+        found = {_KEYWORD_SUGGESTIONS[match.group(0).lower()] for match in _KEYWORD_RE.finditer(analysis)}
+        suggestions = [suggestion for _, suggestion in _SUGGESTION_RULES if suggestion in found]
         
         return suggestions if suggestions else ["cinematic slow motion"]
\ No newline at end of file
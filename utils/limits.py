@@ -0,0 +1,6 @@
+import asyncio
+from config import Config
+
+# Per-provider caps on in-flight requests, shared by every client in the process
+gemini_sem = asyncio.Semaphore(Config.GEMINI_CONCURRENCY)
+stability_sem = asyncio.Semaphore(Config.STABILITY_CONCURRENCY)
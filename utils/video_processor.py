@@ -1,19 +1,21 @@
 import os
+import asyncio
+from pathlib import Path
 from PIL import Image
 import logging
+from config import Config
 
 class VideoProcessor:
     @staticmethod
     def validate_image(file_path: str) -> bool:
         """Validate image file"""
         try:
+            # Check file size first, so oversized files are never opened
+            if os.stat(file_path).st_size > Config.MAX_FILE_SIZE:
+                return False
+            
             with Image.open(file_path) as img:
                 img.verify()
-            
-            # Check file size
-            file_size = os.path.getsize(file_path)
-            if file_size > 10 * 1024 * 1024:  # 10MB
-                return False
                 
             return True
             
@@ -21,34 +23,91 @@ class VideoProcessor:
             logging.error(f"Image validation error: {e}")
             return False
     
+    @staticmethod
+    async def validate_image_async(file_path: str) -> bool:
+        """Validate image file without blocking the event loop"""
+        return await asyncio.to_thread(VideoProcessor.validate_image, file_path)
+    
+    @staticmethod
+    def _save_optimized(img, image_path: str, max_size: tuple) -> str:
+        """Decode, convert and downscale an open image, then save it as an optimized JPEG"""
+        # Let JPEG decode at a reduced scale when the source is much larger
+        img.draft('RGB', max_size)
+        # A full decode fails on truncated or corrupt files
+        img.load()
+        
+        # Convert to RGB if necessary
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        
+        # Resize if too large
+        img.thumbnail(max_size, Image.Resampling.LANCZOS)
+        
+        # Save optimized version next to the original, whatever its extension
+        path = Path(image_path)
+        optimized_path = str(path.with_stem(path.stem + '_optimized').with_suffix('.jpg'))
+        img.save(optimized_path, 'JPEG', quality=85, optimize=True, progressive=True)
+        
+        return optimized_path
+    
     @staticmethod
     def optimize_image(image_path: str, max_size: tuple = (1024, 1024)) -> str:
         """Optimize image for video generation"""
         try:
             with Image.open(image_path) as img:
-                # Convert to RGB if necessary
-                if img.mode != 'RGB':
-                    img = img.convert('RGB')
-                
-                # Resize if too large
-                img.thumbnail(max_size, Image.Resampling.LANCZOS)
-                
-                # Save optimized version
-                optimized_path = image_path.replace('.jpg', '_optimized.jpg')
-                img.save(optimized_path, 'JPEG', quality=85)
-                
-                return optimized_path
+                return VideoProcessor._save_optimized(img, image_path, max_size)
                 
         except Exception as e:
             logging.error(f"Image optimization error: {e}")
             return image_path  # Return original if optimization fails
     
+    @staticmethod
+    async def optimize_image_async(image_path: str, max_size: tuple = (1024, 1024)) -> str:
+        """Optimize image without blocking the event loop"""
+        return await asyncio.to_thread(VideoProcessor.optimize_image, image_path, max_size)
+    
+    @staticmethod
+    def validate_and_optimize(image_path: str, max_size: tuple = (1024, 1024)) -> tuple:
+        """
+        Validate and optimize an image with a single decode.
+        Returns (is_valid, optimized_path); optimized_path is None when invalid.
+        """
+        try:
+            if os.stat(image_path).st_size > Config.MAX_FILE_SIZE:
+                return False, None
+            
+            # Decoding the image replaces verify() as the validity check
+            with Image.open(image_path) as img:
+                return True, VideoProcessor._save_optimized(img, image_path, max_size)
+                
+        except Exception as e:
+            logging.error(f"Image validation error: {e}")
+            return False, None
+    
+    @staticmethod
+    async def validate_and_optimize_async(image_path: str, max_size: tuple = (1024, 1024)) -> tuple:
+        """Validate and optimize image without blocking the event loop"""
+        return await asyncio.to_thread(VideoProcessor.validate_and_optimize, image_path, max_size)
+    
+    @staticmethod
+    def _safe_unlink(file_path: str):
+        """Remove a file, ignoring ones that are already gone"""
+        try:
+            os.unlink(file_path)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.error(f"Cleanup error for {file_path}: {e}")
+    
     @staticmethod
     def cleanup_files(*file_paths):
         """Clean up temporary files"""
         for file_path in file_paths:
-            try:
-                if os.path.exists(file_path):
-                    os.unlink(file_path)
-            except Exception as e:
-                logging.error(f"Cleanup error for {file_path}: {e}")
\ No newline at end of file
+            VideoProcessor._safe_unlink(file_path)
+    
+    @staticmethod
+    async def cleanup_files_async(*file_paths):
+        """Clean up temporary files concurrently without blocking the event loop"""
+        await asyncio.gather(
+            *(asyncio.to_thread(VideoProcessor._safe_unlink, file_path) for file_path in file_paths)
+        )